@@ -0,0 +1,394 @@
+"""
+Load test for the bot: runs the real mensabot.main loop against a local fake Telegram API
+and a local fake stwhh.de serving recorded (or synthetic) HTML, replays a stream of
+updates at a target rate and reports throughput, reply latencies and upstream request counts.
+
+Usage:
+    python loadtest.py --rate 20 --duration 60
+    python loadtest.py --updates updates.jsonl --html-today today.html --html-tomorrow tomorrow.html
+    python loadtest.py --mix food=0.8,listsubs=0.2 --burst 5000
+
+Update files contain one update per line, either a full Telegram update or just {"text": "/food 176"}.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+FAKE_TOKEN = "loadtest"
+DEFAULT_MIX = "food=0.6,locations=0.1,subscribe=0.1,unsubscribe=0.1,listsubs=0.1"
+# chat ids of replayed updates and of burst subscriptions, every update gets its own chat
+# so replies can be matched to the update that caused them, except for generated /unsubscribe
+# updates which are sent from the chat of an earlier /subscribe once that one was answered
+UNSUBSCRIBE_PLACEHOLDER = "/unsubscribe <generated>"
+UPDATE_CHAT_ID_OFFSET = 1_000_000
+BURST_CHAT_ID_OFFSET = 100_000_000
+
+
+class FakeTelegram:
+    """State of the fake Telegram Bot API: pending updates and the times replies arrived."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.new_updates = threading.Condition(self.lock)
+        self.pending: List[dict] = []
+        self.next_update_id = 1
+        self.sent_at: Dict[int, Tuple[int, float]] = {}  # update_id -> chat_id and time the update was released
+        self.replied_at: Dict[int, List[float]] = {}  # chat_id -> times of all replies
+        self.request_counts: Dict[str, int] = {}
+
+    def release(self, update: dict):
+        """Makes an update available to getUpdates."""
+        with self.lock:
+            update["update_id"] = self.next_update_id
+            self.next_update_id += 1
+            self.pending.append(update)
+            self.sent_at[update["update_id"]] = (update["message"]["chat"]["id"], time.perf_counter())
+            self.new_updates.notify_all()
+
+    def get_updates(self, offset: Optional[int], timeout: float) -> List[dict]:
+        """Like Telegram's long polling: waits up to `timeout` seconds for updates to arrive."""
+        with self.lock:
+            if offset is not None:
+                self.pending = [update for update in self.pending if update["update_id"] >= offset]
+            if not self.pending:
+                self.new_updates.wait_for(lambda: self.pending, timeout=timeout)
+            return list(self.pending)
+
+    def record_reply(self, chat_id: int):
+        with self.lock:
+            self.replied_at.setdefault(chat_id, []).append(time.perf_counter())
+
+    def reply_time(self, update_id: int) -> Optional[float]:
+        """Time of the first reply in the update's chat after it was released, call with the lock held."""
+        chat_id, sent_at = self.sent_at[update_id]
+        return next((replied_at for replied_at in self.replied_at.get(chat_id, []) if replied_at >= sent_at), None)
+
+    def count(self, method: str):
+        with self.lock:
+            self.request_counts[method] = self.request_counts.get(method, 0) + 1
+
+
+class FakeMenu:
+    """State of the fake stwhh.de: the served pages and how often they were requested."""
+
+    def __init__(self, html_today: str, html_tomorrow: str):
+        self.pages = {"today": html_today, "next_day": html_tomorrow}
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+    def count(self):
+        with self.lock:
+            self.request_count += 1
+
+
+def make_telegram_handler(telegram: FakeTelegram):
+    class TelegramHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass  # keep the report readable
+
+        def reply(self, payload: dict):
+            body = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            method = url.path.rsplit("/", 1)[-1]
+            telegram.count(method)
+            if method == "getUpdates":
+                query = parse_qs(url.query)
+                offset = int(query["offset"][0]) if "offset" in query else None
+                timeout = float(query.get("timeout", ["0"])[0])
+                self.reply({"ok": True, "result": telegram.get_updates(offset, timeout)})
+            else:
+                self.reply({"ok": True, "result": True})
+
+        def do_POST(self):
+            method = urlparse(self.path).path.rsplit("/", 1)[-1]
+            telegram.count(method)
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            if method == "sendMessage":
+                telegram.record_reply(int(payload["chat_id"]))
+            self.reply({"ok": True, "result": True})
+
+    return TelegramHandler
+
+
+def make_menu_handler(menu: FakeMenu):
+    class MenuHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            menu.count()
+            t_query_param = parse_qs(urlparse(self.path).query).get("t", ["today"])[0]
+            body = menu.pages.get(t_query_param, menu.pages["today"]).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return MenuHandler
+
+
+def start_server(handler) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def synthetic_menu_html(n_locations: int = 30, n_meals: int = 8, date: str = "2025-01-01") -> str:
+    """Builds a page with the structure of the stwhh.de menu, for when no recording is at hand."""
+    options = []
+    locations = []
+    for location_index in range(n_locations):
+        location_id = str(100 + location_index)
+        options.append(f'<li class="mselect__option" data-id="{location_id}" data-filter-id="{location_id}" '
+                       f'for="building-id-{location_id}">Mensa Location {location_index}</li>')
+        meals = "".join(
+            f'<div class="menue-tile"><h5 class="singlemeal__headline">Dish {meal_index} of {location_index}</h5>'
+            f'<span class="singlemeal__info">Studierende</span><span class="singlemeal__info--semibold">2,{meal_index}0 €</span>'
+            f'<span class="singlemeal__info">Bedienstete</span><span class="singlemeal__info--semibold">3,{meal_index}0 €</span>'
+            f'<span class="singlemeal__info">Gäste</span><span class="singlemeal__info--semibold">4,{meal_index}0 €</span></div>'
+            for meal_index in range(n_meals))
+        locations.append(
+            f'<div class="tx-epwerkmenu-menu-location-wrapper" data-location="{location_id}">'
+            f'<div class="tx-epwerkmenu-menu-timestamp-wrapper" data-timestamp="{date}">'
+            f'<div class="menulist__categorywrapper"><h5 class="menulist__categorytitle">Hauptgerichte</h5>'
+            f'{meals}</div></div></div>')
+    return f'<html><body><ul>{"".join(options)}</ul>{"".join(locations)}</body></html>'
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """Parses a 'command=weight,...' string."""
+    weights = {}
+    for part in mix.split(','):
+        command, _, weight = part.partition('=')
+        weights[command.strip().lstrip('/')] = float(weight)
+    return weights
+
+
+def generate_texts(mix: Dict[str, float], location_ids: List[str], count: int) -> List[str]:
+    """Generates message texts for the given command mix."""
+    texts = []
+    for command in random.choices(list(mix.keys()), weights=list(mix.values()), k=count):
+        location_id = random.choice(location_ids)
+        if command == "food":
+            texts.append(f"/food {location_id} {random.choice(['today', 'tomorrow'])}")
+        elif command == "subscribe":
+            texts.append(f"/subscribe {location_id} mon-fri 11:30 today")
+        elif command == "unsubscribe":
+            texts.append(UNSUBSCRIBE_PLACEHOLDER)
+        else:
+            texts.append(f"/{command}")
+    return texts
+
+
+def load_texts(path: str) -> List[str]:
+    """Reads the message texts from a JSONL file of updates."""
+    texts = []
+    with open(path, encoding="utf-8") as update_file:
+        for line in update_file:
+            if not line.strip():
+                continue
+            update = json.loads(line)
+            text = update["message"]["text"] if "message" in update else update.get("text")
+            if text:
+                texts.append(text)
+    return texts
+
+
+def make_update(chat_id: int, text: str) -> dict:
+    return {"message": {"message_id": chat_id, "chat": {"id": chat_id, "type": "private"},
+                        "date": int(time.time()), "text": text}}
+
+
+def add_burst_subscriptions(count: int, location_ids: List[str]) -> float:
+    """
+    Stores `count` subscriptions that are all due at the next minute which is at least
+    30 seconds away, returns the epoch time of that minute.
+    """
+    import schedulerDB as schedDB
+
+    burst_at = (int(time.time() + 30) // 60 + 1) * 60
+    time_str = time.strftime("%H:%M", time.localtime(burst_at))
+    for index in range(count):
+        schedDB.add_schedule_to_db(chat_id=str(BURST_CHAT_ID_OFFSET + index),
+                                   location_id=random.choice(location_ids),
+                                   time_str=time_str,
+                                   days_of_week="*",
+                                   day_to_report="today")
+    return burst_at
+
+
+class SubscriptionTracker:
+    """
+    Remembers the chats of released /subscribe updates, so generated /unsubscribe updates
+    remove a subscription that exists, from the chat that created it.
+    """
+
+    def __init__(self, telegram: FakeTelegram):
+        self.telegram = telegram
+        self.subscribed: List[Tuple[int, int]] = []  # update_id and chat_id of released /subscribe updates
+        self.missed = 0  # /unsubscribe updates replaced because no subscription was confirmed yet
+
+    def released(self, update: dict):
+        if update["message"]["text"].startswith("/subscribe"):
+            self.subscribed.append((update["update_id"], update["message"]["chat"]["id"]))
+
+    def unsubscribe_update(self) -> Optional[dict]:
+        """
+        Returns an /unsubscribe update for the oldest answered /subscribe, using the schedule id
+        stored by the bot, or None if there is none yet.
+        """
+        import schedulerDB as schedDB
+
+        with self.telegram.lock:
+            answered = [(update_id, chat_id) for update_id, chat_id in self.subscribed
+                        if self.telegram.reply_time(update_id) is not None]
+        if not answered:
+            return None
+        schedule_ids: Dict[str, int] = {}
+        for schedule in schedDB.retrieve_schedules():
+            schedule_ids.setdefault(schedule[0], schedule[5])
+        for update_id, chat_id in answered:
+            self.subscribed.remove((update_id, chat_id))
+            if str(chat_id) in schedule_ids:
+                return make_update(chat_id, f"/unsubscribe {schedule_ids[str(chat_id)]}")
+        return None
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", help="JSONL file with the updates to replay (cycled if too short)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"command weights if no update file is given (default {DEFAULT_MIX})")
+    parser.add_argument("--rate", type=float, default=10.0, help="updates per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to send updates for")
+    parser.add_argument("--drain", type=float, default=30.0, help="seconds to wait for outstanding replies")
+    parser.add_argument("--html-today", help="recorded menu page for today (synthetic if not given)")
+    parser.add_argument("--html-tomorrow", help="recorded menu page for tomorrow (defaults to today's)")
+    parser.add_argument("--burst", type=int, default=0,
+                        help="number of subscriptions that all fire in the same minute, like the 11:30 rush")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    html_today = synthetic_menu_html()
+    if args.html_today:
+        with open(args.html_today, encoding="utf-8") as html_file:
+            html_today = html_file.read()
+    html_tomorrow = html_today
+    if args.html_tomorrow:
+        with open(args.html_tomorrow, encoding="utf-8") as html_file:
+            html_tomorrow = html_file.read()
+
+    telegram = FakeTelegram()
+    menu = FakeMenu(html_today, html_tomorrow)
+    telegram_server = start_server(make_telegram_handler(telegram))
+    menu_server = start_server(make_menu_handler(menu))
+
+    # the bot modules read their configuration on import
+    workdir = tempfile.mkdtemp(prefix="mensabot-loadtest-")
+    os.environ["MENSABOT_TOKEN"] = FAKE_TOKEN
+    os.environ["MENSABOT_TELEGRAM_API_URL"] = f"http://127.0.0.1:{telegram_server.server_port}"
+    os.environ["MENSABOT_MENU_URL"] = f"http://127.0.0.1:{menu_server.server_port}/speiseplan"
+    os.environ["MENSABOT_DB_FILE"] = os.path.join(workdir, "mensabot.db")
+    os.environ.setdefault("MENSABOT_LOG_LEVEL", "WARNING")
+    import mensabot
+    import mensascraping as scraper
+
+    location_ids = list(scraper.get_all_location_names_and_ids(html_today).values()) or ["176"]
+    texts = load_texts(args.updates) if args.updates else \
+        generate_texts(parse_mix(args.mix), location_ids, max(1, int(args.rate * args.duration)))
+    if not texts:
+        raise ValueError(f"No message texts found in {args.updates}.")
+    n_updates = max(1, int(args.rate * args.duration))
+
+    burst_at = None
+    if args.burst:
+        burst_at = add_burst_subscriptions(args.burst, location_ids)
+        print(f"{args.burst} subscriptions will fire at {time.strftime('%H:%M', time.localtime(burst_at))}")
+
+    threading.Thread(target=mensabot.main, name="mensabot", daemon=True).start()
+    time.sleep(1)  # let the bot report its commands and start polling
+    menu_requests_before = menu.request_count
+
+    subscriptions = SubscriptionTracker(telegram)
+    start = time.perf_counter()
+    for index in range(n_updates):
+        delay = start + index / args.rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        text = texts[index % len(texts)]
+        update = None
+        if text == UNSUBSCRIBE_PLACEHOLDER:
+            update = subscriptions.unsubscribe_update()
+            if update is None:
+                subscriptions.missed += 1
+                text = "/listsubs"
+        if update is None:
+            update = make_update(UPDATE_CHAT_ID_OFFSET + index, text)
+        telegram.release(update)
+        subscriptions.released(update)
+    send_duration = time.perf_counter() - start
+
+    burst_chats = list(range(BURST_CHAT_ID_OFFSET, BURST_CHAT_ID_OFFSET + args.burst))
+    deadline = time.perf_counter() + args.drain
+    if burst_at is not None:
+        deadline = max(deadline, time.perf_counter() + burst_at - time.time() + args.drain)
+    while time.perf_counter() < deadline:
+        with telegram.lock:
+            missing = sum(telegram.reply_time(update_id) is None for update_id in telegram.sent_at) + \
+                sum(chat_id not in telegram.replied_at for chat_id in burst_chats)
+        if missing == 0:
+            break
+        time.sleep(0.2)
+
+    with telegram.lock:
+        reply_times = {update_id: telegram.reply_time(update_id) for update_id in telegram.sent_at}
+        latencies = [reply_times[update_id] - sent_at for update_id, (_, sent_at) in telegram.sent_at.items()
+                     if reply_times[update_id] is not None]
+        last_reply = max((reply_time for reply_time in reply_times.values() if reply_time is not None), default=start)
+        burst_replies = [telegram.replied_at[chat_id][0] for chat_id in burst_chats if chat_id in telegram.replied_at]
+        request_counts = dict(telegram.request_counts)
+
+    print(f"Updates sent:       {n_updates} in {send_duration:.1f}s ({n_updates / send_duration:.1f}/s target {args.rate}/s)")
+    print(f"Replies received:   {len(latencies)} ({len(latencies) / max(last_reply - start, 1e-9):.1f}/s)")
+    print(f"Reply latency:      p50 {percentile(latencies, 0.5) * 1000:.0f} ms, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.0f} ms, max {max(latencies, default=float('nan')) * 1000:.0f} ms")
+    if subscriptions.missed:
+        print(f"Unsubscribes:       {subscriptions.missed} sent as /listsubs, no answered /subscribe to undo yet")
+    if burst_at is not None:
+        burst_start = burst_at + time.perf_counter() - time.time()
+        burst_span = max(burst_replies) - burst_start if burst_replies else float("nan")
+        print(f"Subscription burst: {len(burst_replies)}/{args.burst} delivered, "
+              f"last one {burst_span:.1f}s after the scheduled minute")
+    print(f"Upstream requests:  stwhh.de {menu.request_count - menu_requests_before}, "
+          f"Telegram {', '.join(f'{method} {count}' for method, count in sorted(request_counts.items()))}")
+    telegram_server.shutdown()
+    menu_server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,32 @@
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 import random
 
 import requests
-from apscheduler.schedulers.background import BackgroundScheduler
 
 import mensascraping as scraper
 import schedulerLogic as sched
 import schedulerDB as schedDB
+import mensainline
+import mensalogging
+
+logger = mensalogging.get_logger("bot")
+
+# Can be pointed to a local Bot API server (or the fake one of loadtest.py)
+TELEGRAM_API_URL = os.getenv("MENSABOT_TELEGRAM_API_URL", "https://api.telegram.org")
+# Seconds Telegram keeps a getUpdates request open while waiting for new updates
+LONG_POLL_SECONDS = int(os.getenv("MENSABOT_LONG_POLL", "30"))
+# Seconds to wait before polling again after a failed poll
+POLL_RETRY_SECONDS = float(os.getenv("MENSABOT_POLL_RETRY", "3"))
+INLINE_WORKERS = 4
+# Updates that may wait for a worker, polling pauses while this many are queued.
+# Their offset is already confirmed to Telegram, so this also bounds what a crash loses.
+MAX_PENDING_COMMANDS = 100
+MAX_PENDING_INLINE_QUERIES = 50
+SEND_TIMEOUT = (3.05, 30)  # seconds to connect, seconds to wait for the answer
 
 OLE_MESSAGES = [
     "How is Otel going Ole?",
@@ -28,6 +46,8 @@ COMMANDS = {
     "subscribe": "<location-id> <cron-days> <hh:mm> <day_to_report: today/tomorrow> - " +
                   "Subscribe to receive food updates for a specific location at specific day(s) for either the same day or the next day. " +
                   "<cron-days> is a string of the form 'mon-fri' or 'sun,tue'",
+    "watch": "<location-id> [today|tomorrow] - Get a message when the menu of a location comes out " +
+             "and whenever dishes or prices change afterwards. Nothing is sent on days without a menu.",
     "unsubscribe": "<schedule_ids> - Unsubscribe from the food updates for a specific location at a specific time.",
     "listsubs": "List all your subscriptions."
 }
@@ -37,6 +57,13 @@ def help_message(message) -> str:
     """Sends a message with information about the bot."""
     return "\n".join([f"/{cmd}: {desc}" for cmd, desc in COMMANDS.items()])
 
+def stale_menu_notice(page: scraper.MenuPage) -> str:
+    """Returns a notice for menus served from the cache because the website is unreachable."""
+    if not page.stale:
+        return ""
+    return "Note: stwhh.de is not reachable right now, this is the menu as of " +\
+           f"{time.strftime('%a %H:%M', time.localtime(page.fetched_at))} ({int(page.age_seconds // 60)} minutes ago).\n"
+
 # --- Handler locations message ---
 def locations_message(message) -> str:
     """Sends a message with the list of Mensa locations."""
@@ -54,7 +81,7 @@ def locations_message(message) -> str:
         return "No Mensa locations found."
 
 
-    location_text = "Available Mensa locations:\n"
+    location_text = stale_menu_notice(html) + "Available Mensa locations:\n"
     for location_name, location_id in locations.items():
         location_text += f"{location_name} (ID: {location_id})\n"
 
@@ -118,11 +145,12 @@ def food_message(message) -> str:
     except Exception as e:
         return f"Error extracting food items for location ID {location_id}: {e}"
 
+    stale_notice = stale_menu_notice(html)
     if not food_items:
-        return f"No food items found for {location_name} ({location_id}){extra_location_string} on {timepoint_str}."
+        return stale_notice + f"No food items found for {location_name} ({location_id}){extra_location_string} on {timepoint_str}."
 
     # Format the food items into a message
-    food_message = f"Food items for {location_name} ({location_id}){extra_location_string}:\n"
+    food_message = stale_notice + f"Food items for {location_name} ({location_id}){extra_location_string}:\n"
     for item in food_items:
         food_message += f"- {item['name']} ({item['category']}): {item['prices']} on {item['date']}\n\n"
     # Send the message with the food items
@@ -202,32 +230,77 @@ def handle_subscribe_message(message, scheduler_instance, chat_id, token) -> Non
                      chat_id=chat_id,
                      text="Invalid day_to_report. Please use 'today' or 'tomorrow'.")
         return
+    time_str = split_message[3]
+    days_of_week = split_message[2]
+    try:
+        # validate before persisting, so we don't store schedules that can never fire
+        sched.get_schedule_slots(time_str, days_of_week)
+    except Exception as e:
+        send_message(token, chat_id, f"Error setting up subscription: {e}")
+        return
+    # persist the schedule in the database
+    try:
+        schedule_id = schedDB.add_schedule_to_db(chat_id=str(chat_id),
+                                                 location_id=location_id,
+                                                 time_str=time_str,
+                                                 days_of_week=days_of_week,
+                                                 day_to_report=day_to_report)
+    except Exception as e:
+        send_message(token, chat_id, f"Error saving subscription to database: {e}")
+        return
     try:
-        sched.set_cron_like_job(scheduler_instance=scheduler_instance,
+        scheduler_instance.add(schedule_id=schedule_id,
                                chat_id=chat_id,
                                location_id=location_id,
-                               token=token,
-                               time_str=split_message[3],
-                               days_of_week=split_message[2],
+                               time_str=time_str,
+                               days_of_week=days_of_week,
                                day_to_report=day_to_report)
     except Exception as e:
         send_message(token, chat_id, f"Error setting up subscription: {e}")
         return
-    # persist the schedule in the database
+    send_message(token=token,
+                    chat_id=chat_id,
+                    text=f"Subscribed to location {location_id} on {split_message[2]} at {split_message[3]}. " +\
+                        f"You will receive food updates at that time for the {'same' if day_to_report == 'today' else 'next'} day.")
+
+def handle_watch_message(message, chat_id, token) -> None:
+    """
+    Receives /watch <location-id> [today|tomorrow]
+    and stores a watch subscription, which is checked by the shared watch job of the scheduler.
+    """
+    split_message = message.split()
+    if not(len(split_message) == 2 or len(split_message) == 3) or split_message[0] != "/watch":
+        send_message(token=token,
+                     chat_id=chat_id,
+                     text="Usage: /watch <location-id> [today|tomorrow]. E.g. /watch 176 or /watch 176 tomorrow")
+        return
+
+    location_id = split_message[1]
+    day_to_report = "today"  # Default value
+    if len(split_message) > 2:
+        day_to_report = split_message[2].lower()
+        if day_to_report not in ["today", "tomorrow"]:
+            send_message(token=token,
+                         chat_id=chat_id,
+                         text="Invalid day_to_report. Please use 'today' or 'tomorrow'.")
+            return
     try:
         schedDB.add_schedule_to_db(chat_id=str(chat_id),
                                    location_id=location_id,
-                                   time_str=split_message[3],
-                                   days_of_week=split_message[2])
+                                   time_str="*",
+                                   days_of_week="mon-sun",
+                                   day_to_report=day_to_report,
+                                   mode="watch")
     except Exception as e:
         send_message(token, chat_id, f"Error saving subscription to database: {e}")
         return
     send_message(token=token,
-                    chat_id=chat_id,
-                    text=f"Subscribed to location {location_id} on {split_message[2]} at {split_message[3]}. " +\
-                        f"You will receive food updates at that time for the {'same' if day_to_report == 'today' else 'next'} day.")
+                 chat_id=chat_id,
+                 text=f"Watching location {location_id}. You will receive the menu for the " +\
+                      f"{'same' if day_to_report == 'today' else 'next'} day once it is out, and a short " +\
+                      "summary whenever it changes.")
 
-def handle_unsubscribe_message(message, scheduler_instance, chat_id, token) -> BackgroundScheduler:
+def handle_unsubscribe_message(message, scheduler_instance, chat_id, token) -> "sched.SubscriptionWheel":
     """
     Receives /unsubscribe <schedule_id>
     and removes the subscription for that location.
@@ -243,12 +316,16 @@ def handle_unsubscribe_message(message, scheduler_instance, chat_id, token) -> B
     removed_ids = []
     for schedule_id in split_message[1:]:
         try:
-            schedDB.remove_schedule_from_db(chat_id=str(chat_id),
-                                           row_id=int(schedule_id))
+            removed = schedDB.remove_schedule_from_db(chat_id=str(chat_id),
+                                                      row_id=int(schedule_id))
         except Exception as e:
             send_message(token, chat_id, f"Error removing job {schedule_id} from scheduler: {e}")
             continue
+        if not removed:
+            send_message(token, chat_id, f"You have no subscription with schedule ID {schedule_id}.")
+            continue
 
+        scheduler_instance.remove(int(schedule_id))
         removed_ids.append(schedule_id)
 
     if not removed_ids or len(removed_ids) == 0:
@@ -257,9 +334,6 @@ def handle_unsubscribe_message(message, scheduler_instance, chat_id, token) -> B
                      text="No valid schedule IDs provided. Please use /listsubs to see your subscriptions.")
         return scheduler_instance
 
-    # now we just restart the scheduler.  Not clean but works
-    scheduler_instance.shutdown(wait=False)  # Stop the scheduler
-    scheduler_instance = sched.startup_scheduler(token)  # Restart the scheduler
     send_message(token=token,
                  chat_id=chat_id,
                  text=f"Unsubscribed from schedule IDs: {', '.join(removed_ids)}. " +\
@@ -282,7 +356,11 @@ def handle_list_subscriptions_message(message, token, chat_id) -> None:
 
     response = "Your active subscriptions:\n"
     for schedule in schedules:
-        if schedule[0] == str(chat_id):  # Only show subscriptions for this user
+        if schedule[0] != str(chat_id):  # Only show subscriptions for this user
+            continue
+        if schedule[6] == 'watch':
+            response += f"Location ID: {schedule[1]}, Watching changes, Day To Report: {schedule[4]} Schedule_id: {schedule[5]}\n"
+        else:
             response += f"Location ID: {schedule[1]}, Days: {schedule[3]}, Time: {schedule[2]}, Day To Report: {schedule[4]} Schedule_id: {schedule[5]}\n"
 
     send_message(token, chat_id, response)
@@ -290,37 +368,123 @@ def handle_list_subscriptions_message(message, token, chat_id) -> None:
 # telegram library sucks so we just call the API directly
 def poll_updates(token: str, last_handled_id: Optional[int]) -> dict:
     """Polls updates from the Telegram Bot API."""
-    url = f"https://api.telegram.org/bot{token}/getUpdates"
-    response = requests.get(url, timeout=3600, params={"offset": last_handled_id+1} if last_handled_id is not None else {}) # long polling, but we still time out after 1 hour
+    url = f"{TELEGRAM_API_URL}/bot{token}/getUpdates"
+    params = {"timeout": LONG_POLL_SECONDS}
+    if last_handled_id is not None:
+        params["offset"] = last_handled_id + 1
+    # long polling, Telegram answers after at most LONG_POLL_SECONDS
+    response = requests.get(url, timeout=(3.05, LONG_POLL_SECONDS + 10), params=params)
     if response.status_code == 200:
         return response.json()
     return {}
 
 def send_message(token: str, chat_id: int, text: str) -> None:
     """Sends a message to a Telegram chat."""
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
+    url = f"{TELEGRAM_API_URL}/bot{token}/sendMessage"
     payload = {
         "chat_id": chat_id,
         "text": text,
     }
-    print(f"Sending message to chat {chat_id}: {text}")
-    response = requests.post(url, json=payload)
+    start = time.perf_counter()
+    response = requests.post(url, json=payload, timeout=SEND_TIMEOUT)
     if response.status_code != 200:
         raise Exception(f"Failed to send message: {response.text}")
+    logger.debug(f"Sent message to chat {chat_id}",
+                 extra=mensalogging.event("message_sent", chat=chat_id, size=len(text),
+                                          latency_ms=round((time.perf_counter() - start) * 1000),
+                                          text=text))
+
+def handle_inline_query(inline_query: dict, token: str) -> None:
+    """Answers an inline query (@bot <text>) with matching locations and today's dishes."""
+    results, cache_time = mensainline.answer_inline_query(inline_query.get('query', ''))
+    url = f"{TELEGRAM_API_URL}/bot{token}/answerInlineQuery"
+    payload = {
+        "inline_query_id": inline_query['id'],
+        "results": results,
+        "cache_time": cache_time,
+    }
+    response = requests.post(url, json=payload, timeout=SEND_TIMEOUT)
+    if response.status_code != 200:
+        raise Exception(f"Failed to answer inline query: {response.text}")
 
 def report_commands(token: str) -> None:
     """Reports the available commands to the telegram API."""
-    url = f"https://api.telegram.org/bot{token}/setMyCommands"
+    url = f"{TELEGRAM_API_URL}/bot{token}/setMyCommands"
     payload = [{"command": cmd, "description": desc} for cmd, desc in COMMANDS.items()]
     for cmd, desc in COMMANDS.items():
         if len(desc) > 255:
-            print(f"Warning: Description for command '{cmd}' is too long: {len(desc)} characters. Max is 255.")
+            logger.warning(f"Description for command '{cmd}' is too long: {len(desc)} characters. Max is 255.")
             raise ValueError(f"Description for command '{cmd}' is too long: {len(desc)} characters. Max is 255.")
-    response = requests.post(url, json={"commands": payload})
+    response = requests.post(url, json={"commands": payload}, timeout=SEND_TIMEOUT)
     if response.status_code != 200:
         raise Exception(f"Failed to set commands: {response.text}")
-    print("Commands reported successfully to Telegram API.")
-    print(response.text)
+    logger.info("Commands reported successfully to Telegram API.",
+                extra=mensalogging.event("commands_reported", response=response.text))
+
+def submit_bounded(executor: ThreadPoolExecutor, slots: threading.BoundedSemaphore, fn, *args) -> None:
+    """Submits fn to the executor, waiting while all slots are taken by queued or running calls."""
+    slots.acquire()
+    future = executor.submit(fn, *args)
+    future.add_done_callback(lambda _: slots.release())
+
+def handle_inline_update(update: dict, token: str, received_at: float) -> None:
+    """Answers an inline query update, logging the latency since the update was received."""
+    update_id = update.get('update_id')
+    try:
+        handle_inline_query(update['inline_query'], token)
+    except Exception as e:
+        logger.error(f"Error answering inline query {update_id}: {e}",
+                     extra=mensalogging.event("inline_failed"))
+        return
+    logger.info(f"Answered inline query {update_id}",
+                extra=mensalogging.event("inline_answered",
+                                         latency_ms=round((time.perf_counter() - received_at) * 1000),
+                                         size=len(update['inline_query'].get('query', ''))))
+
+def handle_message_update(update: dict, scheduler_instance, token: str, received_at: float) -> None:
+    """Handles a command message update, logging the latency since the update was received."""
+    update_id = update.get('update_id')
+    try:
+        chat_id = update['message']['chat']['id']
+    except KeyError:
+        logger.info(f"Update {update_id} does not contain a message or chat ID. Skipping.")
+        return
+
+    try:
+        message_text = update['message']['text']
+    except KeyError:
+        logger.info(f"Update {update_id} does not contain a text message. Skipping.")
+        return
+    command = message_text.split()[0] if message_text.split() else ""
+    try:
+        if message_text.startswith("/help"):
+            response = help_message(message_text)
+            send_message(token, chat_id, response)
+        elif message_text.startswith("/locations"):
+            response = locations_message(message_text)
+            send_message(token, chat_id, response)
+        elif message_text.startswith("/food"):
+            response = food_message(message_text)
+            send_message(token, chat_id, response)
+        elif message_text.startswith("/subscribe"):
+            handle_subscribe_message(message_text, scheduler_instance, chat_id, token)
+        elif message_text.startswith("/watch"):
+            handle_watch_message(message_text, chat_id, token)
+        elif message_text.startswith("/unsubscribe"):
+            handle_unsubscribe_message(message_text, scheduler_instance, chat_id, token)
+        elif message_text.startswith("/listsubs"):
+            handle_list_subscriptions_message(message_text, token, chat_id)
+        else:
+            response = "Unknown command. Please use /help to see available commands."
+            send_message(token, chat_id, response)
+    except Exception as e:
+        logger.error(f"Error handling update {update_id}: {e}",
+                     extra=mensalogging.event("update_failed", command=command, chat=chat_id))
+        return
+    logger.info(f"Handled update {update_id}",
+                extra=mensalogging.event("update_handled", command=command, chat=chat_id,
+                                         latency_ms=round((time.perf_counter() - received_at) * 1000),
+                                         size=len(message_text)))
 
 # --- Main function to set up and run the bot ---
 def main() -> None:
@@ -332,57 +496,40 @@ def main() -> None:
 
     report_commands(BOT_TOKEN)  # Report the available commands to the Telegram API
     scheduler_instance = sched.startup_scheduler(BOT_TOKEN)  # Start the scheduler
+    threading.Thread(target=mensainline.warm_index, name="inline-warmup", daemon=True).start()
+    # The main loop only polls, so new updates are fetched while commands are still being handled.
+    # Commands run one after another as before, inline queries get their own workers, since
+    # Telegram drops inline answers that arrive late.
+    command_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="commands")
+    inline_executor = ThreadPoolExecutor(max_workers=INLINE_WORKERS, thread_name_prefix="inline")
+    command_slots = threading.BoundedSemaphore(MAX_PENDING_COMMANDS)
+    inline_slots = threading.BoundedSemaphore(MAX_PENDING_INLINE_QUERIES)
     while True:
-        time.sleep(10)
         try:
-            # Poll for updates
+            # Long poll for updates, returns as soon as there are any
             updates = poll_updates(BOT_TOKEN, last_handled_id)
         except Exception as e:
-            print(f"Error: {e}. Retrying in 3 seconds...")
+            logger.error(f"Error polling updates: {e}. Retrying in {POLL_RETRY_SECONDS} seconds...")
+            time.sleep(POLL_RETRY_SECONDS)
             continue
+        received_at = time.perf_counter()
 
         # work with the updates
         if "result" not in updates:
-            print("No updates found.")
+            logger.debug("No updates found.")
+            time.sleep(POLL_RETRY_SECONDS)
             continue
 
+        # inline queries first, they have the tightest deadline. Submitting waits while the
+        # queues are full, so the offset only moves past updates a worker will pick up soon.
         for update in updates['result']:
-            update_id = update.get('update_id')
-            last_handled_id = update_id
-            try:
-                chat_id = update['message']['chat']['id']
-            except KeyError:
-                print(f"Update {update_id} does not contain a message or chat ID. Skipping.")
-                continue
-
-            try:
-                message_text = update['message']['text']
-            except KeyError:
-                print(f"Update {update_id} does not contain a text message. Skipping.")
-                continue
-            print(f"Handling update {update_id} for chat {chat_id}: {message_text}")
-            try:
-                if message_text.startswith("/help"):
-                    response = help_message(message_text)
-                    send_message(BOT_TOKEN, chat_id, response)
-                elif message_text.startswith("/locations"):
-                    response = locations_message(message_text)
-                    send_message(BOT_TOKEN, chat_id, response)
-                elif message_text.startswith("/food"):
-                    response = food_message(message_text)
-                    send_message(BOT_TOKEN, chat_id, response)
-                elif message_text.startswith("/subscribe"):
-                    handle_subscribe_message(message_text, scheduler_instance, chat_id, BOT_TOKEN)
-                elif message_text.startswith("/unsubscribe"):
-                    scheduler_instance = handle_unsubscribe_message(message_text, scheduler_instance, chat_id, BOT_TOKEN)
-                elif message_text.startswith("/listsubs"):
-                    handle_list_subscriptions_message(message_text, BOT_TOKEN, chat_id)
-                else:
-                    response = "Unknown command. Please use /help to see available commands."
-                    send_message(BOT_TOKEN, chat_id, response)
-            except Exception as e:
-                print(f"Error handling update {update_id}: {e}")
-
+            if 'inline_query' in update:
+                submit_bounded(inline_executor, inline_slots, handle_inline_update, update, BOT_TOKEN, received_at)
+        for update in updates['result']:
+            if 'inline_query' not in update:
+                submit_bounded(command_executor, command_slots,
+                               handle_message_update, update, scheduler_instance, BOT_TOKEN, received_at)
+            last_handled_id = update.get('update_id')
 
         #{'ok': True, 'result': [{'update_id': 67470315, 'message': {'message_id': 2, 'from':
         # {'id': 832431586, 'is_bot': False, 'first_name': 'Jay', 'last_name': 'Kay',
@@ -0,0 +1,149 @@
+import bisect
+import threading
+from typing import List, Optional, Tuple
+
+import mensascraping as scraper
+import mensalogging
+
+logger = mensalogging.get_logger("inline")
+
+# Telegram accepts at most 50 results per inline answer and 4096 characters per message
+MAX_INLINE_RESULTS = 50
+MAX_MESSAGE_LENGTH = 4096
+# Seconds Telegram may cache an answer, short while the index is still being built
+INLINE_CACHE_SECONDS = 300
+INLINE_CACHE_SECONDS_WITHOUT_INDEX = 5
+
+
+class InlineIndex:
+    """
+    Sorted index over the location and dish names of a menu page, for prefix lookups.
+    Every word of a name starts a key, so 'stud' finds 'Mensa Studierendenhaus'.
+    Results are prebuilt Telegram InlineQueryResultArticles.
+    """
+
+    def __init__(self, page: scraper.MenuPage, results: List[dict], keys: List[Tuple[str, int]]):
+        self.page = page
+        self.page_text = page.text
+        self.results = results
+        self._keys = keys
+        # locations come first in results, so they are returned for an empty query
+        self._location_count = sum(1 for result in results if result["id"].startswith("loc-"))
+
+    def search(self, query: str, limit: int = MAX_INLINE_RESULTS) -> List[dict]:
+        """Returns the results whose name has a word starting with the query, locations first."""
+        query = " ".join(query.lower().split())
+        if not query:
+            return self.results[:min(limit, self._location_count)]
+        matches = set()
+        position = bisect.bisect_left(self._keys, (query, -1))
+        while position < len(self._keys) and self._keys[position][0].startswith(query):
+            matches.add(self._keys[position][1])
+            position += 1
+        return [self.results[index] for index in sorted(matches)[:limit]]
+
+
+def _make_article(result_id: str, title: str, description: str, message_text: str) -> dict:
+    if len(message_text) > MAX_MESSAGE_LENGTH:
+        message_text = message_text[:MAX_MESSAGE_LENGTH - 3] + "..."
+    return {
+        "type": "article",
+        "id": result_id,
+        "title": title,
+        "description": description,
+        "input_message_content": {"message_text": message_text},
+    }
+
+
+def build_index(page: scraper.MenuPage) -> InlineIndex:
+    """Builds the index for the locations and today's dishes of a menu page."""
+    page_text = page.text
+    locations = scraper.get_all_location_names_and_ids(page_text)
+    location_results = []
+    dish_results = []
+    names = []  # the name of each result, in the order of location_results + dish_results
+    dish_names = []
+    for location_name, location_id in locations.items():
+        food_items = scraper.scrape_food_by_location(page_text, location_id)
+        menu_text = f"Food items for {location_name} ({location_id}):\n"
+        for item in food_items:
+            menu_text += f"- {item['name']} ({item['category']}): {item['prices']}\n"
+        if not food_items:
+            menu_text = f"No food items found for {location_name} ({location_id}) today."
+        location_results.append(_make_article(f"loc-{location_id}",
+                                              location_name,
+                                              f"ID {location_id}, {len(food_items)} dishes today",
+                                              menu_text))
+        names.append(location_name)
+        for dish_index, item in enumerate(food_items):
+            price = item['prices'].get("Studierende", "")
+            dish_results.append(_make_article(f"dish-{location_id}-{dish_index}",
+                                              item['name'],
+                                              f"{location_name}, {item['category']} {price}".strip(),
+                                              f"{item['name']} at {location_name} ({location_id}): {item['prices']}"))
+            dish_names.append(item['name'])
+    names += dish_names
+
+    keys = []
+    for index, name in enumerate(names):
+        words = name.lower().split()
+        for word_index in range(len(words)):
+            keys.append((" ".join(words[word_index:]), index))
+    keys.sort()
+    return InlineIndex(page, location_results + dish_results, keys)
+
+
+_index: Optional[InlineIndex] = None
+_index_lock = threading.Lock()
+_rebuilding = False
+
+
+def _rebuild(page: scraper.MenuPage):
+    global _index, _rebuilding
+    try:
+        index = build_index(page)
+        with _index_lock:
+            _index = index
+        logger.info(f"Rebuilt inline index with {len(index.results)} results.")
+    except Exception as e:
+        logger.error(f"Error building inline index: {e}")
+    finally:
+        with _index_lock:
+            _rebuilding = False
+
+
+def get_index() -> Optional[InlineIndex]:
+    """
+    Returns the current index without blocking. If the cached menu page changed since the
+    index was built, the index is rebuilt in the background and the old one is returned meanwhile.
+    An index built from a page of another day is never returned, as its dishes are not today's.
+    """
+    global _rebuilding
+    page = scraper.get_cached_html_by_day("today")
+    with _index_lock:
+        index = _index
+        if index is not None and not index.page.is_from_today:
+            index = None
+        if page is None or (index is not None and index.page_text == page.text) or _rebuilding:
+            return index
+        _rebuilding = True
+    threading.Thread(target=_rebuild, args=(page,), name="inline-index", daemon=True).start()
+    return index
+
+
+def warm_index():
+    """Fetches today's menu and builds the index, so the first inline queries already get results."""
+    try:
+        scraper.get_html_by_day("today")
+    except Exception as e:
+        logger.warning(f"Could not fetch the menu to build the inline index: {e}")
+        return
+    get_index()
+
+
+def answer_inline_query(query: str) -> Tuple[List[dict], int]:
+    """Returns the results for an inline query and how long Telegram may cache them."""
+    index = get_index()
+    if index is None:
+        return [], INLINE_CACHE_SECONDS_WITHOUT_INDEX
+    return index.search(query), INLINE_CACHE_SECONDS
@@ -0,0 +1,185 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from typing import Dict, Optional, Tuple
+
+# Configuration via environment variables
+LOG_FILE = os.getenv("MENSABOT_LOG_FILE")  # log to stdout if not set
+LOG_LEVEL = os.getenv("MENSABOT_LOG_LEVEL", "INFO").upper()
+DEFAULT_LOG_LEVEL = "INFO"
+LOG_MAX_BYTES = int(os.getenv("MENSABOT_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("MENSABOT_LOG_BACKUP_COUNT", "3"))
+# Records waiting to be written, once full new records are dropped instead of blocking the bot
+LOG_QUEUE_SIZE = 10000
+# Fraction of records that are kept per event, e.g. MENSABOT_LOG_SAMPLING="message_sent=0.1,update_handled=0.5"
+# Warnings and errors are never sampled away.
+DEFAULT_SAMPLE_RATES = {
+    "message_sent": 0.1,
+    "location_match": 0.1,
+}
+# Longest field value that is written, longer values (e.g. message texts) are cut
+MAX_FIELD_LENGTH = 200
+
+_listener: Optional["DropReportingListener"] = None
+
+
+def parse_sample_rates(sampling: Optional[str]) -> Dict[str, float]:
+    """Parses a 'event=rate,event=rate' string into a dict, on top of the default rates."""
+    sample_rates = dict(DEFAULT_SAMPLE_RATES)
+    if not sampling:
+        return sample_rates
+    for part in sampling.split(','):
+        event_name, _, rate = part.partition('=')
+        try:
+            sample_rates[event_name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            raise ValueError(f"Invalid log sampling rate '{part}', use e.g. 'message_sent=0.1'.")
+    return sample_rates
+
+
+def event(name: str, **fields) -> dict:
+    """
+    Builds the `extra` argument for a structured log record, e.g.
+    logger.info("Sent message", extra=event("message_sent", chat=chat_id, size=len(text)))
+    """
+    return {"event": name, "fields": fields}
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps only a fraction of the records of each sampled event."""
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.sample_rates.get(getattr(record, "event", None), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class StructuredFormatter(logging.Formatter):
+    """Formats records as a plain message followed by event=... key=value pairs."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        event_name = getattr(record, "event", None)
+        if event_name:
+            line += f" event={event_name}"
+        for key, value in getattr(record, "fields", {}).items():
+            value = str(value)
+            if len(value) > MAX_FIELD_LENGTH:
+                value = value[:MAX_FIELD_LENGTH] + "..."
+            line += f" {key}={value!r}" if " " in value else f" {key}={value}"
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records when the queue is full instead of raising."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.reported_dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DropReportingListener(logging.handlers.QueueListener):
+    """QueueListener that writes a warning whenever the queue handler dropped records since the last report."""
+
+    def __init__(self, queue_handler: DroppingQueueHandler, *handlers: logging.Handler):
+        super().__init__(queue_handler.queue, *handlers)
+        self.queue_handler = queue_handler
+
+    def handle(self, record: logging.LogRecord):
+        self.report_dropped()
+        super().handle(record)
+
+    def report_dropped(self, total: bool = False):
+        """Writes how many records were dropped since the last report, or in total if asked to."""
+        dropped = self.queue_handler.dropped
+        newly_dropped = dropped - self.queue_handler.reported_dropped
+        if newly_dropped <= 0 and not (total and dropped):
+            return
+        self.queue_handler.reported_dropped = dropped
+        message = (f"Dropped {dropped} log records in total because the log queue was full."
+                   if total else f"Dropped {newly_dropped} log records because the log queue was full.")
+        super().handle(logging.makeLogRecord({
+            "name": "mensabot.logging",
+            "levelno": logging.WARNING,
+            "levelname": "WARNING",
+            "msg": message,
+            "event": "log_records_dropped",
+            "fields": {"dropped": newly_dropped, "total": dropped},
+        }))
+
+
+def resolve_log_level(level_name: str) -> Tuple[int, bool]:
+    """Returns the numeric level for a level name and whether the name was valid, falling back to INFO."""
+    level = logging.getLevelName(level_name)
+    if isinstance(level, int):
+        return level, True
+    return logging.getLevelName(DEFAULT_LOG_LEVEL), False
+
+
+def setup_logging():
+    """
+    Routes all records through a bounded queue to a background thread which writes them
+    to stdout or a size-capped, rotated file. Safe to call multiple times.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    if LOG_FILE:
+        output_handler = logging.handlers.RotatingFileHandler(LOG_FILE,
+                                                              maxBytes=LOG_MAX_BYTES,
+                                                              backupCount=LOG_BACKUP_COUNT,
+                                                              encoding="utf-8")
+    else:
+        output_handler = logging.StreamHandler(sys.stdout)
+    output_handler.setFormatter(StructuredFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    # sample before enqueueing, so dropped records cost as little as possible
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(os.getenv("MENSABOT_LOG_SAMPLING"))))
+
+    level, level_is_valid = resolve_log_level(LOG_LEVEL)
+    root_logger = logging.getLogger("mensabot")
+    root_logger.setLevel(level)
+    root_logger.addHandler(queue_handler)
+    root_logger.propagate = False
+
+    _listener = DropReportingListener(queue_handler, output_handler)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    if not level_is_valid:
+        root_logger.warning(f"Invalid MENSABOT_LOG_LEVEL '{LOG_LEVEL}', using {DEFAULT_LOG_LEVEL} instead.")
+
+
+def shutdown_logging():
+    """Flushes the queued records and stops the background writer."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener.report_dropped(total=True)
+        _listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Returns a logger below the 'mensabot' logger, setting up logging if necessary."""
+    setup_logging()
+    return logging.getLogger(f"mensabot.{name}")
@@ -1,11 +1,21 @@
-from typing import Dict, List, Tuple
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 from bs4 import BeautifulSoup
 import requests
 import editdistance
 
+import mensalogging
+
+logger = mensalogging.get_logger("scraping")
 
 # URL/PATH related variables
-BASE_URL = "https://www.stwhh.de/speiseplan"
+BASE_URL = os.getenv("MENSABOT_MENU_URL", "https://www.stwhh.de/speiseplan")
 QUERY_PARAMS = {
     "t": ["today", "next_day"],
 }
@@ -15,6 +25,100 @@ RELEVANT_PRICE_TYPES = [
     "Gäste",
 ]
 
+# Fetch related variables
+FETCH_TIMEOUT = (3.05, 10)  # seconds to connect, seconds to wait for data
+# Seconds a whole fetch may take, a page trickling in slowly is abandoned after this
+FETCH_DEADLINE_SECONDS = 15
+FETCH_CHUNK_SIZE = 64 * 1024
+# Pages younger than this are served from the cache without asking the website
+MENU_FRESH_SECONDS = 60
+# Pages younger than this (and from the same day) are served right away while they are refreshed in the background
+MENU_REVALIDATE_SECONDS = 15 * 60
+# The circuit breaker opens after this many failed fetches in a row and lets a single
+# request through again after BREAKER_RESET_SECONDS
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_RESET_SECONDS = 60
+# If set, a second request is started when the first one did not answer within this many seconds
+HEDGE_AFTER_SECONDS = float(os.getenv("MENSABOT_HEDGE_AFTER", "0")) or None
+
+
+class MenuPage:
+    """The HTML of a menu page and when it was fetched."""
+
+    def __init__(self, text: str, fetched_at: float, stale: bool = False):
+        self.text = text
+        self.fetched_at = fetched_at
+        # True if the website could not be reached and this is an older copy
+        self.stale = stale
+
+    @property
+    def age_seconds(self) -> float:
+        return time.time() - self.fetched_at
+
+    @property
+    def is_from_today(self) -> bool:
+        return time.localtime(self.fetched_at)[:3] == time.localtime()[:3]
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of fetching while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calling the website for a while after repeated failures."""
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.opened_at is not None
+
+    def allow_request(self) -> bool:
+        """Returns True if a request may be made, once open only a single trial request passes."""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial_running or time.time() - self.opened_at < self.reset_seconds:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Opening circuit breaker after {self.failures} failed fetches.")
+                self.opened_at = time.time()
+
+
+breaker = CircuitBreaker()
+_page_cache: Dict[str, MenuPage] = {}  # t query param -> last good page
+_in_flight: Dict[str, Future] = {}  # t query param -> the fetch currently running for it
+_cache_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="menu-fetch")
+
+
+@lru_cache(maxsize=4)
+def _parse_html(html_content: str) -> BeautifulSoup:
+    """Parses the HTML, cached as every command and subscription parses the same few pages."""
+    return BeautifulSoup(html_content, 'lxml')
+
 def scrape_food_by_location(html_content: str, target_location_id: str) -> List[dict]:
     """
     Extracts food items and their details for a specific location from the given HTML.
@@ -28,7 +132,7 @@ def scrape_food_by_location(html_content: str, target_location_id: str) -> List[
               dictionaries, each representing a food item with its name
               and prices. Returns an empty dictionary if the location is not found.
     """
-    soup = BeautifulSoup(html_content, 'lxml')
+    soup = _parse_html(html_content)
     food_data = []
 
     # Find the specific location wrapper
@@ -36,7 +140,7 @@ def scrape_food_by_location(html_content: str, target_location_id: str) -> List[
                                  attrs={'data-location': target_location_id})
 
     if not location_wrapper:
-        print(f"Location with ID '{target_location_id}' not found in the HTML.")
+        logger.debug(f"Location with ID '{target_location_id}' not found in the HTML.")
         return food_data
 
     # Find all timestamp wrappers within the location (assuming food is timestamped)
@@ -92,7 +196,7 @@ def get_all_location_names_and_ids(html_content: str) -> Dict[str, str]:
     Returns:
         Dict[str, str]: location names as keys and their corresponding IDs as values.
     """
-    soup = BeautifulSoup(html_content, 'lxml')
+    soup = _parse_html(html_content)
     location_names = {}
                                             #     <div class="mselect__optionsgroup">Standort Alexandertraße</div>
 
@@ -115,10 +219,107 @@ def get_all_location_names_and_ids(html_content: str) -> Dict[str, str]:
     return location_names
 
 
-def get_html_by_day(t_query_param="today") -> requests.Response:
+def _fetch(url: str) -> str:
     """
-    Gets the HTML content for the specified day from the STW HH website.
+    Fetches the url within FETCH_DEADLINE_SECONDS, hedged with a second request if configured.
+    The body is streamed so the deadline also holds if the website sends it very slowly.
+    """
+    deadline = time.monotonic() + FETCH_DEADLINE_SECONDS
+
+    def fetch_once() -> str:
+        with requests.get(url, timeout=FETCH_TIMEOUT, stream=True) as response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to fetch data from {url}, status code: {response.status_code}")
+            chunks = []
+            for chunk in response.iter_content(chunk_size=FETCH_CHUNK_SIZE):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Fetching {url} took longer than {FETCH_DEADLINE_SECONDS} seconds")
+                chunks.append(chunk)
+            return b"".join(chunks).decode(response.encoding or "utf-8", errors="replace")
+
+    if HEDGE_AFTER_SECONDS is None:
+        return fetch_once()
+    pending = {_hedge_executor.submit(fetch_once)}
+    done, pending = wait(pending, timeout=HEDGE_AFTER_SECONDS)
+    if not done:
+        pending.add(_hedge_executor.submit(fetch_once))
+    error = None
+    while done or pending:
+        for future in done:
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        if not pending:
+            break
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+    raise error
+
+
+def _fetch_page(t_query_param: str, url: str) -> MenuPage:
+    """Fetches a page, updating the circuit breaker and the cache."""
+    try:
+        text = _fetch(url)
+    except Exception:
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    page = MenuPage(text, time.time())
+    with _cache_lock:
+        _page_cache[t_query_param] = page
+    return page
+
+
+def _fetch_page_single_flight(t_query_param: str, url: str) -> MenuPage:
+    """
+    Fetches a page, unless a fetch of it is already running. Then the result of that fetch
+    is awaited instead, so a slow website gets one request per page and not one per caller.
     """
+    with _cache_lock:
+        future = _in_flight.get(t_query_param)
+        is_leader = future is None
+        if is_leader:
+            future = Future()
+            _in_flight[t_query_param] = future
+    if not is_leader:
+        try:
+            return future.result(timeout=FETCH_DEADLINE_SECONDS)
+        except FutureTimeoutError:
+            raise TimeoutError(f"Fetching {url} took longer than {FETCH_DEADLINE_SECONDS} seconds")
+
+    try:
+        if not breaker.allow_request():
+            raise CircuitOpenError(f"{BASE_URL} is currently unreachable, please try again later.")
+        page = _fetch_page(t_query_param, url)
+        future.set_result(page)
+        return page
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _cache_lock:
+            _in_flight.pop(t_query_param, None)
+
+
+def _refresh_in_background(t_query_param: str, url: str):
+    """Refreshes the cached page in a background thread, unless a fetch of it is already running."""
+    with _cache_lock:
+        if t_query_param in _in_flight:
+            return
+
+    def refresh():
+        try:
+            _fetch_page_single_flight(t_query_param, url)
+        except CircuitOpenError:
+            pass  # the breaker lets a refresh through again once it is due
+        except Exception as e:
+            logger.warning(f"Background refresh of {url} failed: {e}")
+
+    threading.Thread(target=refresh, name=f"menu-refresh-{t_query_param}", daemon=True).start()
+
+
+def _get_url(t_query_param: str) -> Tuple[str, str]:
+    """Returns the normalized query parameter and the url of the page for the given day."""
     url = BASE_URL
     if t_query_param == "tomorrow":
         t_query_param = "next_day"
@@ -126,11 +327,55 @@ def get_html_by_day(t_query_param="today") -> requests.Response:
         url += f"?t={t_query_param}"
     else:
         raise ValueError(f"Invalid query parameter: {t_query_param}")
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response
+    return t_query_param, url
+
+
+def get_cached_html_by_day(t_query_param="today") -> Optional[MenuPage]:
+    """
+    Returns the cached page for the specified day without waiting for the website,
+    or None if there is none fetched today. Outdated or missing pages are refreshed in the background.
+    """
+    t_query_param, url = _get_url(t_query_param)
+    with _cache_lock:
+        cached = _page_cache.get(t_query_param)
+    if cached is None or cached.age_seconds >= MENU_FRESH_SECONDS:
+        _refresh_in_background(t_query_param, url)
+    if cached is None or not cached.is_from_today:
+        return None  # yesterday's page would show yesterday's dishes as today's
+    return cached
+
+
+def get_html_by_day(t_query_param="today") -> MenuPage:
+    """
+    Gets the HTML content for the specified day from the STW HH website.
+    Recent pages are served from a cache. If the website is slow or down, the last good
+    page is returned with stale=True while it is refreshed in the background.
+    Raises if the website is unreachable and there is no cached page from today,
+    as a page fetched on another day would show that day's dishes.
+    """
+    t_query_param, url = _get_url(t_query_param)
+    with _cache_lock:
+        cached = _page_cache.get(t_query_param)
+    if cached is not None and not cached.is_from_today:
+        cached = None
+    if cached is not None:
+        if cached.age_seconds < MENU_FRESH_SECONDS:
+            return cached
+        if cached.age_seconds < MENU_REVALIDATE_SECONDS:
+            _refresh_in_background(t_query_param, url)
+            return cached
+
+    if cached is not None and breaker.is_open:
+        # don't make the caller wait for the website while it is known to be down
+        _refresh_in_background(t_query_param, url)
     else:
-        raise Exception(f"Failed to fetch data from {url}, status code: {response.status_code}")
+        try:
+            return _fetch_page_single_flight(t_query_param, url)
+        except Exception as e:
+            if cached is None:
+                raise
+            logger.warning(f"Fetching {url} failed, serving a cached page: {e}")
+    return MenuPage(cached.text, cached.fetched_at, stale=True)
 
 
 def get_closest_locations_by_pattern(pattern: str, locations: Dict[str, str]) -> \
@@ -170,7 +415,10 @@ def get_closest_locations_by_pattern(pattern: str, locations: Dict[str, str]) ->
 
     min_distance = min(editdist2location.keys())
     closest_locations = {name: locations[name] for name in editdist2location[min_distance]}
-    print(editdist2location)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Matched location pattern",
+                     extra=mensalogging.event("location_match", pattern=pattern, distance=min_distance,
+                                              matches=len(closest_locations), distances=editdist2location))
     return closest_locations, min_distance
 
 
@@ -19,6 +19,14 @@ def migrate():
             print("Migration successful: Added 'day_to_report' column to 'messages' table.")
         else:
             print("'day_to_report' column already exists. No migration needed.")
+
+        if 'mode' not in columns:
+            # Add the subscription mode column, existing subscriptions are timed ones
+            cursor.execute("ALTER TABLE messages ADD COLUMN mode TEXT NOT NULL DEFAULT 'timed'")
+            conn.commit()
+            print("Migration successful: Added 'mode' column to 'messages' table.")
+        else:
+            print("'mode' column already exists. No migration needed.")
     except sqlite3.Error as e:
         print(f"An error occurred during migration: {e}")
     finally:
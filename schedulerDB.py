@@ -1,32 +1,43 @@
 import sqlite3
 import os
-from typing import FrozenSet, Set, Tuple
+from typing import Dict, FrozenSet, List, Set, Tuple
 
-DB_FILE = 'mensabot.db'
+import mensalogging
+
+logger = mensalogging.get_logger("db")
+
+DB_FILE = os.getenv('MENSABOT_DB_FILE', 'mensabot.db')
 
 # Database setup
 def add_schedule_to_db(chat_id: str,
                        location_id: str,
                        time_str: str = "10:00",
                        days_of_week: str = 'DAILY',
-                       day_to_report: str = 'today'):
-    """Add a schedule to the database."""
+                       day_to_report: str = 'today',
+                       mode: str = 'timed') -> int:
+    """Add a schedule to the database.
+    mode is either 'timed' (send the menu at time_str) or 'watch' (send menu changes).
+    Returns the schedule_id of the new schedule.
+    """
     try:
         conn = create_connection(DB_FILE)
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO messages (chat_id, location_id, time, days_of_week, day_to_report)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (chat_id, location_id, time_str, days_of_week, day_to_report))
+            INSERT INTO messages (chat_id, location_id, time, days_of_week, day_to_report, mode)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (chat_id, location_id, time_str, days_of_week, day_to_report, mode))
         conn.commit()
+        return cursor.lastrowid
     except sqlite3.Error as e:
-        print(f"An error occurred while adding a schedule: {e}")
+        logger.error(f"An error occurred while adding a schedule: {e}")
         raise Exception(f"Failed to add schedule to database: {e}")
     finally:
         cursor.close()
 
-def remove_schedule_from_db(chat_id: str, row_id: int):
-    """Remove a schedule from the database."""
+def remove_schedule_from_db(chat_id: str, row_id: int) -> bool:
+    """Remove a schedule from the database.
+    Returns False if the chat has no schedule with that id.
+    """
     try:
         conn = create_connection(DB_FILE)
         cursor = conn.cursor()
@@ -34,36 +45,76 @@ def remove_schedule_from_db(chat_id: str, row_id: int):
             DELETE FROM messages
             WHERE id = ? AND chat_id = ?
         ''', (row_id, chat_id))
+        removed = cursor.rowcount > 0
+        if removed:
+            # a watched menu snapshot is only meaningful for its schedule
+            cursor.execute('DELETE FROM menu_snapshots WHERE schedule_id = ?', (row_id,))
         conn.commit()
+        return removed
     except sqlite3.Error as e:
-        print(f"An error occurred while removing a schedule: {e}")
+        logger.error(f"An error occurred while removing a schedule: {e}")
         raise Exception(f"Failed to remove schedule from database: {e}")
     finally:
         cursor.close()
 
-def retrieve_schedules() -> Set[Tuple[str, str, str, str, str, str]]:
+def retrieve_schedules() -> Set[Tuple[str, str, str, str, str, int, str]]:
     """Retrieve all schedules from the database.
     Returns:
         A set of tuples containing
-        chat_id, location_id, time, days_of_week, day_to_report, schedule_id
+        chat_id, location_id, time, days_of_week, day_to_report, schedule_id, mode
     """
     try:
         conn = create_connection(DB_FILE)
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM messages')
+        cursor.execute('''
+            SELECT id, chat_id, location_id, time, days_of_week, day_to_report, mode
+            FROM messages
+        ''')
         rows = cursor.fetchall()
         schedules = []
         for row in rows:
-            schedule = (row[1], row[2], row[3], row[4], row[5], row[0])
-              # chat_id, location_id, time, days_of_week, day_to_report, schedule_id
+            schedule = (row[1], row[2], row[3], row[4], row[5], row[0], row[6])
+              # chat_id, location_id, time, days_of_week, day_to_report, schedule_id, mode
             schedules.append(schedule)  # Convert to frozenset for immutability
         return set(schedules)  # Return as a set for uniqueness
     except sqlite3.Error as e:
-        print(f"An error occurred while retrieving schedules: {e}")
+        logger.error(f"An error occurred while retrieving schedules: {e}")
         return set()
     finally:
         cursor.close()
 
+def retrieve_menu_snapshots() -> Dict[int, Tuple[str, str]]:
+    """Retrieve the last menus that were sent for all watch schedules.
+    Returns:
+        A dict of schedule_id -> (menu_date, menu as a JSON string).
+    """
+    try:
+        conn = create_connection(DB_FILE)
+        cursor = conn.cursor()
+        cursor.execute('SELECT schedule_id, menu_date, menu FROM menu_snapshots')
+        return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    except sqlite3.Error as e:
+        logger.error(f"An error occurred while retrieving menu snapshots: {e}")
+        raise Exception(f"Failed to retrieve menu snapshots from database: {e}")
+    finally:
+        cursor.close()
+
+def store_menu_snapshots(snapshots: List[Tuple[int, str, str]]):
+    """Store the menus (schedule_id, menu_date, menu as a JSON string) that were last sent for watch schedules."""
+    try:
+        conn = create_connection(DB_FILE)
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT OR REPLACE INTO menu_snapshots (schedule_id, menu_date, menu)
+            VALUES (?, ?, ?)
+        ''', snapshots)
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"An error occurred while storing menu snapshots: {e}")
+        raise Exception(f"Failed to store menu snapshots in database: {e}")
+    finally:
+        cursor.close()
+
 def create_table(conn: sqlite3.Connection):
     """Create a table in the database if it does not exist."""
     try:
@@ -75,12 +126,30 @@ def create_table(conn: sqlite3.Connection):
                 location_id TEXT NOT NULL,
                 time TEXT DEFAULT '10:00',
                 days_of_week TEXT NOT NULL DEFAULT 'mon-fri',
-                day_to_report TEXT DEFAULT 'today'
+                day_to_report TEXT DEFAULT 'today',
+                mode TEXT NOT NULL DEFAULT 'timed'
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS menu_snapshots (
+                schedule_id INTEGER PRIMARY KEY,
+                menu_date TEXT NOT NULL,
+                menu TEXT NOT NULL
             )
         ''')
+        # Databases from before these columns existed are upgraded in place,
+        # otherwise every query naming them fails and no subscription is sent
+        cursor.execute("PRAGMA table_info(messages)")
+        columns = [column[1] for column in cursor.fetchall()]
+        if 'day_to_report' not in columns:
+            cursor.execute("ALTER TABLE messages ADD COLUMN day_to_report TEXT DEFAULT 'today'")
+            logger.info("Added 'day_to_report' column to 'messages' table.")
+        if 'mode' not in columns:
+            cursor.execute("ALTER TABLE messages ADD COLUMN mode TEXT NOT NULL DEFAULT 'timed'")
+            logger.info("Added 'mode' column to 'messages' table.")
         conn.commit()
     except sqlite3.Error as e:
-        print(f"An error occurred while creating the table: {e}")
+        logger.error(f"An error occurred while creating the table: {e}")
     finally:
         cursor.close()
 
@@ -1,21 +1,210 @@
-from apscheduler.schedulers.background import BackgroundScheduler
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Tuple
 
 import schedulerDB as schedDB
+import mensascraping as scraper
 import mensabot as bot
+import mensalogging
+
+logger = mensalogging.get_logger("scheduler")
+
+# Watched menus are checked every WATCH_INTERVAL_MINUTES during WATCH_HOURS
+WATCH_INTERVAL_MINUTES = 15
+WATCH_HOURS = range(6, 15)
+
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+# If the dispatcher falls behind by at most this many minutes, the missed minutes are still sent
+MAX_CATCHUP_MINUTES = 5
+# After the clock moved back by at most this many minutes (e.g. end of DST), the repeated
+# minutes are skipped, larger jumps are treated as a clock reset
+MAX_CLOCK_HOLD_MINUTES = 120
+DISPATCH_WORKERS = 4
+
+_watch_check_lock = threading.Lock()
 
 def send_food_message(chat_id: int, location_id: str, token: str, day_to_report: str = 'today'):
     """Sends a food message to the specified chat."""
+    start = time.perf_counter()
     try:
         food_message = bot.food_message(f"/food {location_id} {day_to_report}")
         bot.send_message(token, chat_id, food_message)
     except Exception as e:
-        print(f"Error sending food message: {e}")
+        logger.error(f"Error sending food message: {e}",
+                     extra=mensalogging.event("subscription_failed", chat=chat_id, location=location_id))
+        return
+    logger.info("Sent subscription",
+                extra=mensalogging.event("subscription_sent", chat=chat_id, location=location_id,
+                                         latency_ms=round((time.perf_counter() - start) * 1000),
+                                         size=len(food_message)))
+
+def menu_to_snapshot(food_items: List[dict]) -> Dict[Tuple[str, str, str], dict]:
+    """
+    Reduces scraped food items to a dict of (date, category, dish name) -> prices.
+    Keying by all three keeps dishes with the same name in different categories or timestamp blocks apart.
+    """
+    return {(str(item['date']), item['category'], item['name']): item['prices'] for item in food_items}
+
+def snapshot_to_json(menu: Dict[Tuple[str, str, str], dict]) -> str:
+    """Serializes a menu snapshot for the database, JSON has no tuple keys so it is stored as a list."""
+    return json.dumps([[date, category, name, prices] for (date, category, name), prices in menu.items()])
+
+def snapshot_from_json(menu_json: str) -> Dict[Tuple[str, str, str], dict]:
+    """Inverse of snapshot_to_json."""
+    return {(date, category, name): prices for date, category, name, prices in json.loads(menu_json)}
+
+def compute_menu_diff(old_menu: Dict[Tuple[str, str, str], dict], new_menu: Dict[Tuple[str, str, str], dict]) -> \
+    Tuple[List[Tuple[str, str, str]], List[Tuple[str, str, str]], List[Tuple[str, str, str]]]:
+    """
+    Compares two menu snapshots (see menu_to_snapshot).
 
-def set_cron_like_job(scheduler_instance: BackgroundScheduler, chat_id: str, location_id: str,
-                      token: str, time_str: str = "10:00", days_of_week: str = 'mon-fri',
-                      day_to_report: str = 'today'):
-    """Sets up a recurring 'cron-like' job."""
-    # Set up daily messages from mo to fr at the specified time
+    Returns:
+        The keys of the added dishes, the removed dishes and the dishes whose prices changed.
+    """
+    added = [key for key in new_menu if key not in old_menu]
+    removed = [key for key in old_menu if key not in new_menu]
+    changed = [key for key in new_menu if key in old_menu and new_menu[key] != old_menu[key]]
+    return added, removed, changed
+
+def format_menu_diff(location_name: str, location_id: str, day_to_report: str,
+                     old_menu: Dict[Tuple[str, str, str], dict], new_menu: Dict[Tuple[str, str, str], dict]) -> str:
+    """Formats the changes between two menu snapshots, returns an empty string if nothing changed."""
+    added, removed, changed = compute_menu_diff(old_menu, new_menu)
+    if not added and not removed and not changed:
+        return ""
+    diff_message = f"Menu update for {location_name} ({location_id}) {day_to_report}:\n"
+    for key in added:
+        _, category, name = key
+        diff_message += f"+ {name} ({category}): {new_menu[key]}\n"
+    for _, category, name in removed:
+        diff_message += f"- {name} ({category})\n"
+    for key in changed:
+        _, category, name = key
+        diff_message += f"~ {name} ({category}): {old_menu[key]} -> {new_menu[key]}\n"
+    return diff_message
+
+def format_menu_appeared(location_name: str, location_id: str, day_to_report: str,
+                         menu: Dict[Tuple[str, str, str], dict]) -> str:
+    """Formats a compact message for a menu that was not seen before."""
+    menu_message = f"Menu for {location_name} ({location_id}) {day_to_report} is out:\n"
+    for (_, category, name), prices in menu.items():
+        menu_message += f"- {name} ({category}): {prices}\n"
+    return menu_message
+
+def check_watched_menus(token: str):
+    """
+    Checks the menus of all watch subscriptions and notifies the subscribers
+    when a menu appears or changes. Days without a menu are skipped silently.
+    Each page and location is only fetched/parsed once per check, no matter
+    how many subscribers watch it. If the previous check is still running the
+    check is skipped, as both would diff against the same snapshots and send twice.
+    """
+    if not _watch_check_lock.acquire(blocking=False):
+        logger.warning("Previous check of watched menus is still running, skipping this one.")
+        return
+    try:
+        _check_watched_menus(token)
+    finally:
+        _watch_check_lock.release()
+
+def _check_watched_menus(token: str):
+    watch_schedules = [schedule for schedule in schedDB.retrieve_schedules()
+                       if schedule[6] == 'watch']
+    if not watch_schedules:
+        return
+    snapshots = schedDB.retrieve_menu_snapshots()
+
+    html_by_day = {}  # day_to_report -> html text
+    location_names_by_day = {}  # day_to_report -> {location_id: location_name}
+    menus = {}  # (day_to_report, location_id) -> (menu_date, menu snapshot, menu as JSON)
+    sent_snapshots = []  # (schedule_id, menu_date, menu as JSON) of the updates sent in this check
+    try:
+        for chat_id, location_id, _, _, day_to_report, schedule_id, _ in watch_schedules:
+            try:
+                if day_to_report not in html_by_day:
+                    html_by_day[day_to_report] = scraper.get_html_by_day(t_query_param=day_to_report).text
+                    location_names_by_day[day_to_report] = {
+                        location_id: location_name for location_name, location_id in
+                        scraper.get_all_location_names_and_ids(html_by_day[day_to_report]).items()}
+                if (day_to_report, location_id) not in menus:
+                    food_items = scraper.scrape_food_by_location(html_by_day[day_to_report], location_id)
+                    menu_date = ",".join(sorted({str(item['date']) for item in food_items}))
+                    menu = menu_to_snapshot(food_items)
+                    menus[(day_to_report, location_id)] = (menu_date, menu, snapshot_to_json(menu))
+            except Exception as e:
+                logger.error(f"Error checking watched menu for location {location_id}: {e}")
+                continue
+
+            menu_date, menu, menu_json = menus[(day_to_report, location_id)]
+            if not menu:
+                continue  # closed or no menu published yet, stay silent
+            location_name = location_names_by_day[day_to_report].get(location_id, location_id)
+
+            snapshot = snapshots.get(schedule_id)
+            if snapshot is None or snapshot[0] != menu_date:
+                message = format_menu_appeared(location_name, location_id, day_to_report, menu)
+            elif snapshot[1] == menu_json:
+                continue  # unchanged, no need to diff
+            else:
+                message = format_menu_diff(location_name, location_id, day_to_report,
+                                           snapshot_from_json(snapshot[1]), menu)
+            if not message:
+                continue
+            try:
+                bot.send_message(token, int(chat_id), message)
+            except Exception as e:
+                logger.error(f"Error sending menu update to chat {chat_id}: {e}")
+                continue
+            sent_snapshots.append((schedule_id, menu_date, menu_json))
+    finally:
+        # written in one go, even if the check failed halfway, so sent updates are not repeated
+        if sent_snapshots:
+            schedDB.store_menu_snapshots(sent_snapshots)
+
+@lru_cache(maxsize=None)
+def parse_days_of_week(days_of_week: str) -> FrozenSet[int]:
+    """
+    Parses a cron-like days of week string such as 'mon-fri', 'sun,tue', '*' or 'mon-fri/2' into
+    weekday numbers (0 = Monday). Results are cached, as most subscriptions share a handful of strings.
+    """
+    if not days_of_week:
+        raise ValueError("Days of week cannot be empty.")
+    days = set()
+    for part in days_of_week.lower().split(','):
+        part = part.strip()
+        part, _, step_str = part.partition('/')
+        if step_str and not (step_str.isdigit() and int(step_str) > 0):
+            raise ValueError(f"Invalid step '{step_str}' in days of week, use e.g. 'mon-fri/2'.")
+        step = int(step_str) if step_str else 1
+        if part in ("*", "daily"):
+            days.update(range(0, 7, step))
+            continue
+        bounds = part.split('-')
+        if len(bounds) > 2:
+            raise ValueError(f"Invalid days of week: {days_of_week}")
+        try:
+            indices = [int(bound) if bound.isdigit() else DAY_NAMES.index(bound) for bound in bounds]
+        except ValueError:
+            raise ValueError(f"Invalid day '{part}' in days of week, use e.g. 'mon-fri' or 'sun,tue'.")
+        if not all(0 <= index < 7 for index in indices):
+            raise ValueError(f"Invalid day '{part}' in days of week, days are numbered 0 (mon) to 6 (sun).")
+        if len(indices) == 1:
+            if step_str:
+                raise ValueError(f"A step needs a range, e.g. 'mon-fri/2', not '{part}/{step_str}'.")
+            days.add(indices[0])
+        else:
+            # ranges may wrap around the week, e.g. 'fri-mon'
+            start, end = indices
+            days.update(day % 7 for day in range(start, end + 1 if end >= start else end + 8, step))
+    return frozenset(days)
+
+def parse_time(time_str: str) -> Tuple[int, int]:
+    """Parses a 'HH:MM' string into hour and minute."""
     if not time_str:
         raise ValueError("Time string cannot be empty.")
     time_str_split = time_str.split(':')
@@ -23,40 +212,163 @@ def set_cron_like_job(scheduler_instance: BackgroundScheduler, chat_id: str, loc
        not (0 <= int(time_str_split[0]) < 24) or not (0 <= int(time_str_split[1]) < 60) or \
        len(time_str_split[0]) != 2 or len(time_str_split[1]) != 2:
         raise ValueError("Time string must be in the format 'HH:MM' with valid hour and minute values.")
+    return int(time_str_split[0]), int(time_str_split[1])
+
+def get_minute_of_week(timepoint: Optional[time.struct_time] = None) -> int:
+    """Returns the minute of the week (0 = Monday 00:00) of the given local time, defaults to now."""
+    if timepoint is None:
+        timepoint = time.localtime()
+    return timepoint.tm_wday * MINUTES_PER_DAY + timepoint.tm_hour * 60 + timepoint.tm_min
+
+def get_schedule_slots(time_str: str, days_of_week: str) -> List[int]:
+    """Returns the minutes of the week at which a schedule is due."""
+    hour, minute = parse_time(time_str)
+    return [day * MINUTES_PER_DAY + hour * 60 + minute for day in sorted(parse_days_of_week(days_of_week))]
+
+class SubscriptionWheel:
+    """
+    Dispatches timed subscriptions from a wheel indexed by the minute of the week.
+    A single thread wakes up once per minute and looks up the subscriptions due in that minute,
+    subscriptions can be added and removed at any time without rebuilding the wheel.
+    Also triggers the shared check of watch subscriptions.
+    """
+
+    def __init__(self, token: str):
+        self.token = token
+        # minute of week -> {schedule_id: (chat_id, location_id, day_to_report)}
+        self._slots: Dict[int, Dict[int, Tuple[int, str, str]]] = {}
+        # schedule_id -> minutes of week, so removal only touches the relevant slots
+        self._schedule_slots: Dict[int, List[int]] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._last_minute: Optional[int] = None
+
+    def __len__(self) -> int:
+        return len(self._schedule_slots)
+
+    def add(self, schedule_id: int, chat_id: str, location_id: str, time_str: str = "10:00",
+            days_of_week: str = 'mon-fri', day_to_report: str = 'today'):
+        """Adds a timed subscription, raises a ValueError if the schedule is invalid."""
+        if day_to_report not in ['today', 'tomorrow']:
+            raise ValueError("day_to_report must be either 'today' or 'tomorrow'.")
+        slots = get_schedule_slots(time_str, days_of_week)
+        job = (int(chat_id), location_id, day_to_report)
+        with self._lock:
+            self._remove_unlocked(schedule_id)
+            self._schedule_slots[schedule_id] = slots
+            for slot in slots:
+                self._slots.setdefault(slot, {})[schedule_id] = job
+
+    def remove(self, schedule_id: int) -> bool:
+        """Removes a subscription, returns False if it was not on the wheel."""
+        with self._lock:
+            return self._remove_unlocked(schedule_id)
+
+    def _remove_unlocked(self, schedule_id: int) -> bool:
+        slots = self._schedule_slots.pop(schedule_id, None)
+        if slots is None:
+            return False
+        for slot in slots:
+            jobs = self._slots.get(slot)
+            if jobs is not None:
+                jobs.pop(schedule_id, None)
+                if not jobs:
+                    del self._slots[slot]
+        return True
+
+    def due(self, minute_of_week: int) -> List[Tuple[int, str, str]]:
+        """Returns the (chat_id, location_id, day_to_report) jobs due at the given minute of the week."""
+        with self._lock:
+            return list(self._slots.get(minute_of_week % MINUTES_PER_WEEK, {}).values())
+
+    def start(self):
+        """Starts the dispatcher thread."""
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(max_workers=DISPATCH_WORKERS)
+        self._last_minute = get_minute_of_week()
+        self._thread = threading.Thread(target=self._run, name="subscription-wheel", daemon=True)
+        self._thread.start()
+
+    def shutdown(self, wait: bool = True):
+        """Stops the dispatcher thread, optionally waiting for running jobs."""
+        self._stop_event.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            # sleep until the start of the next minute
+            self._stop_event.wait(60 - time.time() % 60)
+            if self._stop_event.is_set():
+                break
+            try:
+                self._tick()
+            except Exception:
+                # keep the thread alive, otherwise all timed subscriptions silently stop
+                logger.exception("Error dispatching subscriptions")
 
-    if day_to_report not in ['today', 'tomorrow']:
-        raise ValueError("day_to_report must be either 'today' or 'tomorrow'.")
+    def _tick(self):
+        """Dispatches the minutes since the last tick, without repeating any after the clock moved back."""
+        now = get_minute_of_week()
+        gap = (now - self._last_minute) % MINUTES_PER_WEEK
+        if gap > MINUTES_PER_WEEK // 2:
+            # the clock moved backwards (end of DST, NTP correction), these minutes were already sent
+            moved_back = MINUTES_PER_WEEK - gap
+            if moved_back <= MAX_CLOCK_HOLD_MINUTES:
+                # keep the old minute, so nothing is dispatched until the clock has passed it again
+                logger.warning(f"Clock moved back by {moved_back} minutes, not dispatching them again.")
+                return
+            logger.warning(f"Clock moved back by {moved_back} minutes, resetting the dispatcher.")
+        elif gap > MAX_CATCHUP_MINUTES:
+            # the clock jumped forward (host suspended, start of DST), only send what is due now
+            logger.warning(f"Clock jumped forward by {gap} minutes, skipping the missed minutes.")
+            self.dispatch(now)
+        else:
+            for offset in range(1, gap + 1):
+                self.dispatch((self._last_minute + offset) % MINUTES_PER_WEEK)
+        self._last_minute = now
 
-    scheduler_instance.add_job(send_food_message,
-        'cron',
-        day_of_week=days_of_week,
-        hour=int(time_str.split(':')[0]),
-        minute=int(time_str.split(':')[1]),
-        args=[int(chat_id), location_id, token, day_to_report],
-    )
+    def dispatch(self, minute_of_week: int):
+        """Hands all jobs due at the given minute of the week to the worker threads."""
+        for chat_id, location_id, day_to_report in self.due(minute_of_week):
+            self._executor.submit(send_food_message, chat_id, location_id, self.token, day_to_report)
+        minute_of_day = minute_of_week % MINUTES_PER_DAY
+        if minute_of_day // 60 in WATCH_HOURS and minute_of_day % WATCH_INTERVAL_MINUTES == 0:
+            # A single check handles all watch subscriptions, so the website is scraped
+            # once per interval instead of once per subscriber
+            self._executor.submit(check_watched_menus, self.token)
 
 
-def startup_scheduler(token: str):
+def startup_scheduler(token: str) -> SubscriptionWheel:
     """
     Initializes the scheduler, reading from the database and setting the relevant jobs.
     Should be called at the start of the bot, not multiple times or we spam
     """
-    scheduler = BackgroundScheduler()
+    scheduler = SubscriptionWheel(token)
     schedules = schedDB.retrieve_schedules()
-    for schedule_item in schedules:
-        chat_id = schedule_item[0]  # chat_id
-        location_id = schedule_item[1]
-        time_str = schedule_item[2]
-        days_of_week = schedule_item[3]
-        day_to_report = schedule_item[4]
-        print(f"Setting up job for chat_id: {chat_id}, location_id: {location_id}, time: {time_str}, days: {days_of_week} day_to_report: {day_to_report}")
-        set_cron_like_job(scheduler_instance=scheduler,
+    rejected = []
+    for chat_id, location_id, time_str, days_of_week, day_to_report, schedule_id, mode in schedules:
+        if mode == 'watch':
+            continue  # handled by the shared check_watched_menus job
+        try:
+            scheduler.add(schedule_id=schedule_id,
                           chat_id=chat_id,
                           location_id=location_id,
-                          token=token,
                           time_str=time_str,
                           days_of_week=days_of_week,
                           day_to_report=day_to_report)
+        except ValueError as e:
+            rejected.append(f"schedule {schedule_id} (chat {chat_id}, days '{days_of_week}', "
+                            f"time '{time_str}', day_to_report '{day_to_report}'): {e}")
+    logger.info(f"Loaded {len(scheduler)} timed subscriptions into the scheduler.")
+    if rejected:
+        # these subscriptions are still in the database but will never be sent
+        logger.error(f"{len(rejected)} timed subscriptions could not be loaded and will NOT be sent, "
+                     "fix or remove them in the database:\n" + "\n".join(rejected))
 
     # Start the scheduler process
     scheduler.start()
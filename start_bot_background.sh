@@ -16,10 +16,10 @@ python3 -m pip install -r requirements.txt
 if ! command -v tmux &> /dev/null
 then
     echo "tmux could not be found, using nohup instead"
-    echo "The output will be saved in mensabotout.txt"
-    nohup python3 -u mensabot.py > mensabotout.txt 2>&1 &
+    echo "The logs will be saved in mensabot.log, other output in mensabotout.txt"
+    MENSABOT_LOG_FILE=mensabot.log nohup python3 -u mensabot.py > mensabotout.txt 2>&1 &
     exit 0
 fi
 
 # run with tmux
-tmux new -d -s mensabot_session 'python3 -u mensabot.py > mensabotout.txt'
+tmux new -d -s mensabot_session 'MENSABOT_LOG_FILE=mensabot.log python3 -u mensabot.py > mensabotout.txt'
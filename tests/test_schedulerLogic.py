@@ -0,0 +1,167 @@
+import pytest
+
+import schedulerLogic as sched
+
+MON, TUE, WED, THU, FRI, SAT, SUN = range(7)
+
+
+def minute_of_week(day: int, hour: int, minute: int) -> int:
+    return day * sched.MINUTES_PER_DAY + hour * 60 + minute
+
+
+# --- parse_days_of_week ---
+@pytest.mark.parametrize("days_of_week, expected", [
+    ("mon-fri", {MON, TUE, WED, THU, FRI}),
+    ("sun,tue", {SUN, TUE}),
+    ("SAT", {SAT}),
+    ("*", set(range(7))),
+    ("DAILY", set(range(7))),
+    ("0,6", {MON, SUN}),
+    ("fri-mon", {FRI, SAT, SUN, MON}),  # wraps around the week
+    ("sun-sun", {SUN}),
+    ("mon-fri/2", {MON, WED, FRI}),
+    ("*/3", {MON, THU, SUN}),
+    ("sat-tue/2", {SAT, MON}),
+    ("mon, wed", {MON, WED}),
+])
+def test_parse_days_of_week(days_of_week, expected):
+    assert sched.parse_days_of_week(days_of_week) == frozenset(expected)
+
+
+@pytest.mark.parametrize("days_of_week", ["", "foo", "mon-", "mon-tue-wed", "7", "mon-fri/0", "mon-fri/x", "mon/2"])
+def test_parse_days_of_week_rejects_invalid(days_of_week):
+    with pytest.raises(ValueError):
+        sched.parse_days_of_week(days_of_week)
+
+
+@pytest.mark.parametrize("time_str", ["", "1:00", "24:00", "10:60", "10-00", "ab:cd"])
+def test_parse_time_rejects_invalid(time_str):
+    with pytest.raises(ValueError):
+        sched.parse_time(time_str)
+
+
+# --- SubscriptionWheel.add/remove/due ---
+def test_wheel_add_and_due():
+    wheel = sched.SubscriptionWheel("token")
+    wheel.add(1, "10", "176", "11:30", "mon-fri", "today")
+    wheel.add(2, "20", "177", "11:30", "mon", "tomorrow")
+
+    assert sorted(wheel.due(minute_of_week(MON, 11, 30))) == [(10, "176", "today"), (20, "177", "tomorrow")]
+    assert wheel.due(minute_of_week(TUE, 11, 30)) == [(10, "176", "today")]
+    assert wheel.due(minute_of_week(SAT, 11, 30)) == []
+    assert wheel.due(minute_of_week(MON, 11, 31)) == []
+    assert len(wheel) == 2
+
+
+def test_wheel_remove_cleans_up_slots():
+    wheel = sched.SubscriptionWheel("token")
+    wheel.add(1, "10", "176", "11:30", "mon-fri", "today")
+
+    assert wheel.remove(1)
+    assert not wheel.remove(1)
+    assert wheel.due(minute_of_week(MON, 11, 30)) == []
+    assert wheel._slots == {}
+    assert len(wheel) == 0
+
+
+def test_wheel_add_replaces_existing_schedule():
+    wheel = sched.SubscriptionWheel("token")
+    wheel.add(1, "10", "176", "11:30", "mon", "today")
+    wheel.add(1, "10", "176", "12:00", "tue", "today")
+
+    assert wheel.due(minute_of_week(MON, 11, 30)) == []
+    assert wheel.due(minute_of_week(TUE, 12, 0)) == [(10, "176", "today")]
+
+
+def test_wheel_add_rejects_invalid_schedule():
+    wheel = sched.SubscriptionWheel("token")
+    with pytest.raises(ValueError):
+        wheel.add(1, "10", "176", "11:30", "mon-fri", "yesterday")
+    with pytest.raises(ValueError):
+        wheel.add(1, "10", "176", "25:00", "mon-fri", "today")
+    assert len(wheel) == 0
+
+
+# --- SubscriptionWheel._tick ---
+@pytest.fixture
+def ticking_wheel(monkeypatch):
+    """A wheel whose clock is set by the test and which records the dispatched minutes."""
+    wheel = sched.SubscriptionWheel("token")
+    dispatched = []
+    clock = {"now": 0}
+    monkeypatch.setattr(wheel, "dispatch", dispatched.append)
+    monkeypatch.setattr(sched, "get_minute_of_week", lambda: clock["now"])
+
+    def tick(now):
+        dispatched.clear()
+        clock["now"] = now
+        wheel._tick()
+        return list(dispatched)
+
+    return wheel, tick
+
+
+def test_tick_same_minute_dispatches_nothing(ticking_wheel):
+    wheel, tick = ticking_wheel
+    wheel._last_minute = 100
+    assert tick(100) == []
+
+
+def test_tick_small_gap_catches_up(ticking_wheel):
+    wheel, tick = ticking_wheel
+    wheel._last_minute = 100
+    assert tick(101) == [101]
+    assert tick(101 + sched.MAX_CATCHUP_MINUTES) == list(range(102, 102 + sched.MAX_CATCHUP_MINUTES))
+
+
+def test_tick_small_gap_wraps_around_the_week(ticking_wheel):
+    wheel, tick = ticking_wheel
+    wheel._last_minute = sched.MINUTES_PER_WEEK - 2
+    assert tick(1) == [sched.MINUTES_PER_WEEK - 1, 0, 1]
+
+
+def test_tick_large_forward_jump_only_dispatches_now(ticking_wheel):
+    wheel, tick = ticking_wheel
+    wheel._last_minute = 100
+    assert tick(100 + 60) == [160]
+    assert wheel._last_minute == 160
+
+
+def test_tick_backward_jump_does_not_repeat_minutes(ticking_wheel):
+    wheel, tick = ticking_wheel
+    wheel._last_minute = minute_of_week(SUN, 3, 0)
+    # end of DST: the clock goes back from 03:00 to 02:00
+    for minute in range(minute_of_week(SUN, 2, 0), minute_of_week(SUN, 3, 1)):
+        assert tick(minute) == []
+    assert tick(minute_of_week(SUN, 3, 1)) == [minute_of_week(SUN, 3, 1)]
+
+
+def test_tick_backward_jump_across_the_week_boundary(ticking_wheel):
+    wheel, tick = ticking_wheel
+    wheel._last_minute = 1
+    assert tick(sched.MINUTES_PER_WEEK - 1) == []
+    assert tick(2) == [2]
+
+
+def test_tick_large_backward_jump_resets(ticking_wheel):
+    wheel, tick = ticking_wheel
+    wheel._last_minute = minute_of_week(WED, 12, 0)
+    assert tick(minute_of_week(TUE, 12, 0)) == []
+    assert wheel._last_minute == minute_of_week(TUE, 12, 0)
+    assert tick(minute_of_week(TUE, 12, 1)) == [minute_of_week(TUE, 12, 1)]
+
+
+def test_run_survives_dispatch_errors(monkeypatch):
+    wheel = sched.SubscriptionWheel("token")
+    calls = []
+
+    def failing_tick():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        wheel._stop_event.set()
+
+    monkeypatch.setattr(wheel, "_tick", failing_tick)
+    monkeypatch.setattr(wheel._stop_event, "wait", lambda timeout: None)
+    wheel._run()
+    assert len(calls) == 2